@@ -1,23 +1,137 @@
 import os
-from typing import TypedDict, List
+import re
+import asyncio
+import logging
+import threading
+from typing import TypedDict, List, Literal, Optional
+from zoneinfo import ZoneInfo
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
+from cachetools import TTLCache
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.tools import tool
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import BaseMessage, SystemMessage, trim_messages
+from langchain_core.messages.utils import count_tokens_approximately
 from langgraph.prebuilt import create_react_agent
 from langgraph.graph import MessagesState
 from langgraph.types import Command
-from database import get_db_connection, get_player_game_status
+from database import (
+    db_conn,
+    execute_prepared,
+    register_prepared_statement,
+    get_player_game_status,
+    phone_lookup_candidates
+)
 from psycopg2.extras import RealDictCursor
-from prompts import AGENT_SYSTEM_PROMPT, ERROR_MESSAGES
+from prompts import (
+    AGENT_SYSTEM_PROMPT,
+    ROUTER_SYSTEM_PROMPT,
+    REPLY_SYSTEM_PROMPT,
+    ERROR_MESSAGES,
+    render_rsvp_confirmation
+)
 
 # Load environment variables (requires GOOGLE_API_KEY)
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
+# Game times are stored as TIMESTAMPTZ and shown to players in this zone
+GAME_TIMEZONE = ZoneInfo(os.getenv("GAME_TIMEZONE", "Asia/Jerusalem"))
+
 # 1. Setup Model
 llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
 
 # 2. Define Tools with improved design
+
+# Short-lived cache for the read-only tools; cleared whenever a response is logged
+_tool_cache = TTLCache(maxsize=256, ttl=30)
+_tool_cache_lock = threading.Lock()
+
+def _cached_tool_result(key):
+    with _tool_cache_lock:
+        return _tool_cache.get(key)
+
+def _cache_tool_result(key, result: str) -> str:
+    with _tool_cache_lock:
+        _tool_cache[key] = result
+    return result
+
+# Game lookups come in two variants: the next upcoming game, or a game on a given date
+_GAME_FILTERS = {
+    "next": ("start_time > NOW()", ()),
+    "on_date": ("start_time::date = $1", ("date",)),
+}
+
+_GAME_DETAILS_QUERY = """
+    WITH g AS (
+        SELECT id, start_time, location, max_players FROM games
+        WHERE {game_filter}
+        ORDER BY start_time ASC
+        LIMIT 1
+    )
+    SELECT g.start_time, g.location, g.max_players, (
+        SELECT COUNT(*) FROM game_responses r
+        WHERE r.game_id = g.id AND r.status = 'confirmed'
+    ) AS confirmed_count
+    FROM g
+"""
+
+# One row per response status with the player names aggregated;
+# a game with no responses yields a single row with NULL status/names
+_AVAILABILITY_QUERY = """
+    WITH g AS (
+        SELECT id, max_players FROM games
+        WHERE {game_filter}
+        ORDER BY start_time ASC
+        LIMIT 1
+    )
+    SELECT g.max_players, gr.status, array_agg(p.name ORDER BY p.name) AS names
+    FROM g
+    LEFT JOIN (
+        game_responses gr JOIN players p ON p.id = gr.player_id
+    ) ON gr.game_id = g.id
+    GROUP BY g.max_players, gr.status
+"""
+
+for _variant, (_game_filter_sql, _arg_types) in _GAME_FILTERS.items():
+    register_prepared_statement(
+        f"game_details_{_variant}", _GAME_DETAILS_QUERY.format(game_filter=_game_filter_sql), _arg_types
+    )
+    register_prepared_statement(
+        f"availability_{_variant}", _AVAILABILITY_QUERY.format(game_filter=_game_filter_sql), _arg_types
+    )
+
+# Resolves the player (first matching phone candidate) and the next game, and
+# upserts the response, all in one round-trip. A NULL column means that lookup failed.
+register_prepared_statement("log_response_upsert", """
+    WITH p AS (
+        SELECT id, name FROM players
+        WHERE phone_number = ANY($1)
+        ORDER BY array_position($1, phone_number)
+        LIMIT 1
+    ),
+    g AS (
+        SELECT id, start_time FROM games
+        WHERE start_time > NOW()
+        ORDER BY start_time ASC
+        LIMIT 1
+    ),
+    upsert AS (
+        INSERT INTO game_responses (game_id, player_id, status, updated_at)
+        SELECT g.id, p.id, $2, NOW() FROM p, g
+        ON CONFLICT (game_id, player_id)
+        DO UPDATE SET status = EXCLUDED.status, updated_at = NOW()
+    )
+    SELECT (SELECT name FROM p) AS player_name, (SELECT start_time FROM g) AS start_time
+""", ("text[]", "text"))
+
+def _game_variant(date_query: str):
+    """Returns the prepared statement variant and params for a 'next' or YYYY-MM-DD query."""
+    if date_query.lower() == "next":
+        return "next", ()
+    return "on_date", (date_query,)
+
 @tool
 def get_game_details(date_query: str = "next") -> str:
     """
@@ -30,60 +144,39 @@ def get_game_details(date_query: str = "next") -> str:
     Returns:
         Game details including time, location, and player count.
     """
-    conn = get_db_connection()
-    if not conn:
-        return ERROR_MESSAGES["database_error"]
-    
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Find the game
-        if date_query.lower() == "next":
-            cursor.execute("""
-                SELECT * FROM games 
-                WHERE start_time > NOW() 
-                ORDER BY start_time ASC 
-                LIMIT 1
-            """)
-        else:
-            cursor.execute("""
-                SELECT * FROM games 
-                WHERE start_time::date = %s::date
-            """, (date_query,))
-            
-        game = cursor.fetchone()
+    cache_key = ("get_game_details", date_query.lower())
+    cached = _cached_tool_result(cache_key)
+    if cached is not None:
+        return cached
+
+    variant, params = _game_variant(date_query)
+
+    with db_conn() as conn:
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        if not game:
-            return ERROR_MESSAGES["no_upcoming_game"]
+            # Find the game and its confirmed count in one round-trip
+            execute_prepared(cursor, f"game_details_{variant}", params)
             
-        game_id = game['id']
+            game = cursor.fetchone()
         
-        # Get number of confirmed players
-        cursor.execute("""
-            SELECT COUNT(*) as confirmed_count
-            FROM game_responses
-            WHERE game_id = %s AND status = 'confirmed'
-        """, (game_id,))
+            if not game:
+                return ERROR_MESSAGES["no_upcoming_game"]
         
-        count_result = cursor.fetchone()
-        confirmed_count = count_result['confirmed_count'] if count_result else 0
+            # Format the response naturally
+            game_time = game['start_time']
+            location = game['location']
+            max_players = game['max_players']
+            confirmed_count = game['confirmed_count']
         
-        # Format the response naturally
-        game_time = game['start_time']
-        location = game['location']
-        max_players = game['max_players']
+            return _cache_tool_result(cache_key, (
+                f"Game is at {location} on {game_time}. "
+                f"Currently {confirmed_count}/{max_players} confirmed."
+            ))
         
-        return (
-            f"Game is at {location} on {game_time}. "
-            f"Currently {confirmed_count}/{max_players} confirmed."
-        )
-        
-    except Exception as e:
-        print(f"Error getting game details: {e}")
-        return ERROR_MESSAGES["database_error"]
-    finally:
-        if conn:
-            conn.close()
+        except Exception as e:
+            log.error("Error getting game details: %s", e)
+            return ERROR_MESSAGES["database_error"]
 
 @tool
 def check_availability(date_query: str = "next") -> str:
@@ -97,67 +190,81 @@ def check_availability(date_query: str = "next") -> str:
     Returns:
         List of players by response status.
     """
-    conn = get_db_connection()
-    if not conn:
-        return ERROR_MESSAGES["database_error"]
-    
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cache_key = ("check_availability", date_query.lower())
+    cached = _cached_tool_result(cache_key)
+    if cached is not None:
+        return cached
+
+    variant, params = _game_variant(date_query)
+
+    with db_conn() as conn:
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        # Find the game
-        if date_query.lower() == "next":
-            cursor.execute("""
-                SELECT * FROM games 
-                WHERE start_time > NOW() 
-                ORDER BY start_time ASC 
-                LIMIT 1
-            """)
-        else:
-            cursor.execute("""
-                SELECT * FROM games 
-                WHERE start_time::date = %s::date
-            """, (date_query,))
-            
-        game = cursor.fetchone()
+            # Find the game and its responses in one round-trip
+            execute_prepared(cursor, f"availability_{variant}", params)
+        
+            rows = cursor.fetchall()
         
-        if not game:
-            return ERROR_MESSAGES["no_upcoming_game"]
+            if not rows:
+                return ERROR_MESSAGES["no_upcoming_game"]
             
-        game_id = game['id']
+            max_players = rows[0]['max_players']
+            names_by_status = {row['status']: row['names'] for row in rows}
         
-        # Get responses
-        cursor.execute("""
-            SELECT p.name, gr.status 
-            FROM game_responses gr
-            JOIN players p ON gr.player_id = p.id
-            WHERE gr.game_id = %s
-        """, (game_id,))
+            confirmed = names_by_status.get('confirmed', [])
+            maybe = names_by_status.get('maybe', [])
+            declined = names_by_status.get('declined', [])
         
-        responses = cursor.fetchall()
+            result_parts = []
+            if confirmed:
+                result_parts.append(f"Confirmed ({len(confirmed)}/{max_players}): {', '.join(confirmed)}")
+            if maybe:
+                result_parts.append(f"Maybe: {', '.join(maybe)}")
+            if declined:
+                result_parts.append(f"Can't make it: {', '.join(declined)}")
         
-        confirmed = [r['name'] for r in responses if r['status'] == 'confirmed']
-        maybe = [r['name'] for r in responses if r['status'] == 'maybe']
-        declined = [r['name'] for r in responses if r['status'] == 'declined']
+            if not result_parts:
+                return _cache_tool_result(cache_key, "No responses yet for this game.")
+            
+            return _cache_tool_result(cache_key, "\\n".join(result_parts))
         
-        result_parts = []
-        if confirmed:
-            result_parts.append(f"Confirmed ({len(confirmed)}/{game['max_players']}): {', '.join(confirmed)}")
-        if maybe:
-            result_parts.append(f"Maybe: {', '.join(maybe)}")
-        if declined:
-            result_parts.append(f"Can't make it: {', '.join(declined)}")
+        except Exception as e:
+            log.error("Error checking availability: %s", e)
+            return ERROR_MESSAGES["database_error"]
+
+def _record_response(phone_number: str, status: str):
+    """
+    Upserts the player's response for the next upcoming game.
+    Returns (row with player_name and start_time, None) on success,
+    or (None, ERROR_MESSAGES key) if it couldn't be recorded.
+    """
+    with db_conn() as conn:
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        if not result_parts:
-            return "No responses yet for this game."
-            
-        return "\\n".join(result_parts)
+            # Find player and next game, and upsert the response in one statement
+            execute_prepared(
+                cursor,
+                "log_response_upsert",
+                (phone_lookup_candidates(phone_number), status)
+            )
+            result = cursor.fetchone()
         
-    except Exception as e:
-        print(f"Error checking availability: {e}")
-        return ERROR_MESSAGES["database_error"]
-    finally:
-        if conn:
-            conn.close()
+            if result['player_name'] is None:
+                return None, "player_not_found"
+            if result['start_time'] is None:
+                return None, "no_upcoming_game"
+        
+            conn.commit()
+            with _tool_cache_lock:
+                _tool_cache.clear()
+            return result, None
+        
+        except Exception as e:
+            log.error("Error logging response: %s", e)
+            conn.rollback()
+            return None, "database_error"
 
 @tool
 def log_response(phone_number: str, status: str) -> str:
@@ -177,64 +284,61 @@ def log_response(phone_number: str, status: str) -> str:
     if status.lower() not in valid_statuses:
         return f"Invalid status. Must be one of: {', '.join(valid_statuses)}"
     
-    conn = get_db_connection()
-    if not conn:
-        return ERROR_MESSAGES["database_error"]
-        
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # 1. Find Player by phone using the helper function that handles normalization
-        from database import get_player_by_phone as db_get_player_by_phone
-        player = db_get_player_by_phone(phone_number)
-        
-        if not player:
-            return ERROR_MESSAGES["player_not_found"]
-            
-        player_id = player['id']
-        player_name = player['name']
-        
-        # 2. Find Next Game
-        cursor.execute("""
-            SELECT id, start_time FROM games 
-            WHERE start_time > NOW() 
-            ORDER BY start_time ASC 
-            LIMIT 1
-        """)
-        game = cursor.fetchone()
-        
-        if not game:
-            return ERROR_MESSAGES["no_upcoming_game"]
-            
-        game_id = game['id']
-        
-        # 3. Upsert Response
-        cursor.execute("""
-            INSERT INTO game_responses (game_id, player_id, status, updated_at)
-            VALUES (%s, %s, %s, NOW())
-            ON CONFLICT (game_id, player_id) 
-            DO UPDATE SET status = EXCLUDED.status, updated_at = NOW()
-        """, (game_id, player_id, status.lower()))
-        
-        conn.commit()
-        
-        # Return a natural confirmation (agent will relay this)
-        status_messages = {
-            'confirmed': f"Got it! {player_name} is in for {game['start_time']}.",
-            'declined': f"No worries, marked {player_name} as can't make it.",
-            'maybe': f"Cool, {player_name} is a maybe for now.",
-            'pending': f"Updated {player_name}'s status to pending."
-        }
-        
-        return status_messages.get(status.lower(), f"Updated {player_name}'s status to {status}.")
-        
-    except Exception as e:
-        print(f"Error logging response: {e}")
-        conn.rollback()
-        return ERROR_MESSAGES["database_error"]
-    finally:
-        if conn:
-            conn.close()
+    result, error = _record_response(phone_number, status.lower())
+    if error:
+        return ERROR_MESSAGES[error]
+    
+    player_name = result['player_name']
+    
+    # Return the outcome for the agent to phrase in its reply
+    status_messages = {
+        'confirmed': f"Got it! {player_name} is in for {result['start_time']}.",
+        'declined': f"No worries, marked {player_name} as can't make it.",
+        'maybe': f"Cool, {player_name} is a maybe for now.",
+        'pending': f"Updated {player_name}'s status to pending."
+    }
+    
+    return status_messages.get(status.lower(), f"Updated {player_name}'s status to {status}.")
+
+async def record_rsvp(phone_number: str, status: str, language: str) -> str:
+    """
+    Records an RSVP without going through the agent and returns the
+    confirmation to send to the player, in their language.
+    """
+    result, error = await asyncio.to_thread(_record_response, phone_number, status)
+    if error:
+        return ERROR_MESSAGES[error]
+    game_time = result['start_time'].astimezone(GAME_TIMEZONE)
+    return render_rsvp_confirmation(status, game_time, language)
+
+# Whole-message replies that are unambiguous enough to log without the LLM
+_TRIVIAL_REPLIES = {
+    "confirmed": re.compile(r"\s*(yes|yeah|yep|in|i'?m in|כן|בא|confirm(ed)?)\s*[!.]?\s*", re.IGNORECASE),
+    "declined": re.compile(r"\s*(no|nope|out|i'?m out|לא|לא בא)\s*[!.]?\s*", re.IGNORECASE),
+    "maybe": re.compile(r"\s*(maybe|not sure|אולי)\s*[!.]?\s*", re.IGNORECASE),
+}
+
+def classify_trivial_reply(message: str) -> Optional[str]:
+    """
+    Returns the RSVP status for a bare yes/no/maybe style reply, or None
+    if the message needs the agent to understand it.
+    """
+    for status, pattern in _TRIVIAL_REPLIES.items():
+        if pattern.fullmatch(message):
+            return status
+    return None
+
+def trim_history(messages, max_tokens: int = 1500):
+    """
+    Keeps the most recent messages that fit in max_tokens, so long chats
+    don't inflate the prompt sent to the LLM.
+    """
+    return trim_messages(
+        messages,
+        max_tokens=max_tokens,
+        token_counter=count_tokens_approximately,
+        strategy="last",
+    )
 
 # List of tools available to the agent
 tools = [get_game_details, check_availability, log_response]
@@ -243,10 +347,59 @@ tools = [get_game_details, check_availability, log_response]
 class AgentState(TypedDict):
     messages: List[BaseMessage]
 
+# Static system prompts are converted to messages once instead of on every call
+_ROUTER_SYSTEM_MESSAGE = SystemMessage(ROUTER_SYSTEM_PROMPT)
+_AGENT_SYSTEM_MESSAGE = SystemMessage(AGENT_SYSTEM_PROMPT)
+_REPLY_SYSTEM_MESSAGE = SystemMessage(REPLY_SYSTEM_PROMPT)
+
 # 4. Create Agent with improved system prompt
-agent_executor = create_react_agent(llm, tools, prompt=AGENT_SYSTEM_PROMPT)
+agent_executor = create_react_agent(llm, tools, prompt=_AGENT_SYSTEM_MESSAGE)
+
+# 5. Single-call router for webhook messages
+class RouterSchema(BaseModel):
+    """How to handle the player's latest message."""
+    intent: Literal['get_details', 'availability', 'log', 'chat'] = Field(
+        description="'log' for an RSVP, 'get_details' for when/where, 'availability' for who's coming, otherwise 'chat'"
+    )
+    date_query: str = Field(
+        default="next",
+        description="The game date the player refers to (YYYY-MM-DD), or 'next' for the upcoming game"
+    )
+    status: Optional[Literal['confirmed', 'declined', 'maybe']] = Field(
+        default=None,
+        description="The player's RSVP when intent is 'log'"
+    )
+
+router_llm = llm.with_structured_output(RouterSchema)
+
+async def route_and_respond(messages, phone_number: str, language: str):
+    """
+    Classifies the message with one structured LLM call and runs the matching
+    tool directly, instead of letting the ReAct agent plan and call tools.
+    RSVPs are recorded and confirmed in the player's language; other intents
+    make one more LLM call to phrase the reply. Returns the reply content.
+    """
+    route = await router_llm.ainvoke([_ROUTER_SYSTEM_MESSAGE, *messages])
+    log.info("Routed message as %s", route)
+
+    if route.intent == "log" and route.status:
+        return await record_rsvp(phone_number, route.status, language)
+
+    # The reply model has no tools, so it gets a prompt that doesn't offer them
+    reply_messages = [_REPLY_SYSTEM_MESSAGE, *messages]
+    if route.intent == "log":
+        reply_messages.append(("system", "[RSVP UNCLEAR] Nothing was recorded. Ask the player if they're in, out, or a maybe."))
+    elif route.intent == "get_details":
+        tool_result = await get_game_details.ainvoke({"date_query": route.date_query})
+        reply_messages.append(("system", f"[GAME DETAILS] {tool_result}"))
+    elif route.intent == "availability":
+        tool_result = await check_availability.ainvoke({"date_query": route.date_query})
+        reply_messages.append(("system", f"[AVAILABILITY] {tool_result}"))
+
+    response = await llm.ainvoke(reply_messages)
+    return response.content
 
-# 5. Execution / Testing
+# 6. Execution / Testing
 if __name__ == "__main__":
     print("Running agent test...")
     user_input = "Hey, I'm in for the next game!"
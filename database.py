@@ -1,62 +1,150 @@
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import logging
+import threading
+from contextlib import contextmanager
+from psycopg2.extensions import connection as PGConnection
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import RealDictCursor, execute_values
 from dotenv import load_dotenv
 from phone_utils import normalize_phone_number
 
 load_dotenv()
 
-def get_db_connection():
+log = logging.getLogger(__name__)
+
+class _PooledConnection(PGConnection):
+    """Connection that remembers which statements it has PREPAREd."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+# Shared connection pool, created on first use so importing this module
+# doesn't require a reachable database.
+_pool = None
+_pool_lock = threading.Lock()
+
+# Connections kept open while idle (and so keeping their prepared statements):
+# the usual number of concurrent webhook/invite DB calls
+_POOL_MIN_CONN = 10
+_POOL_MAX_CONN = 20
+# ThreadedConnectionPool raises instead of waiting when it's exhausted,
+# so checkouts queue on this first
+_pool_slots = threading.BoundedSemaphore(_POOL_MAX_CONN)
+
+def get_pool() -> ThreadedConnectionPool:
+    """Returns the process-wide connection pool, creating it if needed."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                try:
+                    _pool = ThreadedConnectionPool(
+                        minconn=_POOL_MIN_CONN,
+                        maxconn=_POOL_MAX_CONN,
+                        user=os.environ.get("user"),
+                        password=os.environ.get("password"),
+                        host=os.environ.get("host"),
+                        port=os.environ.get("port"),
+                        dbname=os.environ.get("dbname"),
+                        connection_factory=_PooledConnection
+                    )
+                except Exception as e:
+                    log.error("Error connecting to database: %s", e)
+                    raise e
+    return _pool
+
+@contextmanager
+def db_conn():
+    """
+    Checks a connection out of the pool and returns it when the block exits,
+    waiting for a free connection if all of them are in use.
+    Any transaction left open is rolled back by the pool on return.
+    """
+    pool = get_pool()
+    with _pool_slots:
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            pool.putconn(conn)
+
+# Statements run through execute_prepared(), keyed by name: (arg types, query)
+_prepared_statements = {}
+
+def register_prepared_statement(name: str, query: str, arg_types: tuple = ()):
+    """
+    Registers a query to be run as a server-side prepared statement.
+    Placeholders in the query use PostgreSQL's $1, $2, ... syntax.
+    """
+    _prepared_statements[name] = (arg_types, query)
+
+def execute_prepared(cursor, name: str, params: tuple = ()):
     """
-    Establishes and returns a connection to the PostgreSQL database.
-    Returns a connection object that should be closed after use.
+    Executes a registered statement, PREPAREing it on the cursor's
+    connection the first time that connection runs it.
     """
-    try:
-        conn = psycopg2.connect(
-            user=os.environ.get("user"),
-            password=os.environ.get("password"),
-            host=os.environ.get("host"),
-            port=os.environ.get("port"),
-            dbname=os.environ.get("dbname")
-        )
-        return conn
-    except Exception as e:
-        print(f"Error connecting to database: {e}")
-        raise e
+    conn = cursor.connection
+    if name not in conn.prepared_statements:
+        arg_types, query = _prepared_statements[name]
+        signature = f"({', '.join(arg_types)})" if arg_types else ""
+        cursor.execute(f"PREPARE {name}{signature} AS {query}")
+        conn.prepared_statements.add(name)
+
+    if params:
+        placeholders = ", ".join(["%s"] * len(params))
+        cursor.execute(f"EXECUTE {name}({placeholders})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+register_prepared_statement("next_game", """
+    SELECT id, start_time, location, max_players FROM games
+    WHERE start_time > NOW()
+    ORDER BY start_time ASC
+    LIMIT 1
+""")
 
 def create_game(start_time: str, location: str = "Beach Court 1", max_players: int = 4):
     """Creates a new game in the database."""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("""
-            INSERT INTO games (start_time, location, max_players)
-            VALUES (%s, %s, %s)
-            RETURNING *
-        """, (start_time, location, max_players))
-        game = cursor.fetchone()
-        conn.commit()
-        return game
-    except Exception as e:
-        conn.rollback()
-        print(f"Error creating game: {e}")
-        return None
-    finally:
-        conn.close()
+    with db_conn() as conn:
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("""
+                INSERT INTO games (start_time, location, max_players)
+                VALUES (%s, %s, %s)
+                RETURNING id, start_time, location, max_players
+            """, (start_time, location, max_players))
+            game = cursor.fetchone()
+            conn.commit()
+            return game
+        except Exception as e:
+            conn.rollback()
+            log.error("Error creating game: %s", e)
+            return None
 
 def get_active_players():
     """Retrieves all active players from the database."""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT * FROM players WHERE active = TRUE")
-        players = cursor.fetchall()
-        return players
-    except Exception as e:
-        print(f"Error fetching players: {e}")
-        return []
-    finally:
-        conn.close()
+    with db_conn() as conn:
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("""
+                SELECT id, name, phone_number, language, country FROM players
+                WHERE active = TRUE
+            """)
+            players = cursor.fetchall()
+            return players
+        except Exception as e:
+            log.error("Error fetching players: %s", e)
+            return []
+
+def phone_lookup_candidates(phone_number: str, country: str = "Israel") -> list:
+    """
+    Returns the phone formats a player might be stored under, most preferred first:
+    the normalized number, the original input, and the Israeli local format.
+    """
+    normalized_phone = normalize_phone_number(phone_number, country)
+    local_phone = "0" + normalized_phone[3:] if normalized_phone[:3] == "972" else normalized_phone
+    return list(dict.fromkeys([normalized_phone, phone_number, local_phone]))
 
 def get_player_by_phone(phone_number: str, country: str = "Israel"):
     """
@@ -70,38 +158,22 @@ def get_player_by_phone(phone_number: str, country: str = "Israel"):
     Returns:
         Player dict if found, None otherwise
     """
-    normalized_phone = normalize_phone_number(phone_number, country)
+    # Normalized format first, then the formats that show up with inconsistent data
+    candidates = phone_lookup_candidates(phone_number, country)
     
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Try exact match first
-        cursor.execute("SELECT * FROM players WHERE phone_number = %s", (normalized_phone,))
-        player = cursor.fetchone()
-        
-        if player:
-            return player
-            
-        # If not found, try other common formats
-        # This helps with data inconsistency
-        alternate_formats = [
-            phone_number,  # Original format
-            "0" + normalized_phone[3:] if normalized_phone.startswith("972") else normalized_phone,  # Israeli local format
-        ]
-        
-        for alt_phone in alternate_formats:
-            cursor.execute("SELECT * FROM players WHERE phone_number = %s", (alt_phone,))
-            player = cursor.fetchone()
-            if player:
-                return player
-        
-        return None
-    except Exception as e:
-        print(f"Error fetching player by phone: {e}")
-        return None
-    finally:
-        conn.close()
+    with db_conn() as conn:
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("""
+                SELECT id, name, phone_number, language, country FROM players
+                WHERE phone_number = ANY(%s)
+                ORDER BY array_position(%s, phone_number)
+                LIMIT 1
+            """, (candidates, candidates))
+            return cursor.fetchone()
+        except Exception as e:
+            log.error("Error fetching player by phone: %s", e)
+            return None
 
 def get_player_game_status(phone_number: str, game_id=None):
     """
@@ -117,87 +189,107 @@ def get_player_game_status(phone_number: str, game_id=None):
     player = get_player_by_phone(phone_number)
     if not player:
         return None
-        
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # If no game_id specified, get next upcoming game
-        if game_id is None:
-            cursor.execute("""
-                SELECT id, start_time, location, max_players FROM games 
-                WHERE start_time > NOW() 
-                ORDER BY start_time ASC 
-                LIMIT 1
-            """)
-            game = cursor.fetchone()
-            if not game:
-                return {"error": "No upcoming games"}
-            game_id = game['id']
-        else:
+
+    status = get_player_game_status_by_id(player['id'], game_id)
+    if status and "error" not in status:
+        status["player_name"] = player['name']
+    return status
+
+def get_player_game_status_by_id(player_id, game_id=None):
+    """
+    Same as get_player_game_status, for callers that already resolved the player.
+    The returned dict doesn't include the player's name.
+    """
+    with db_conn() as conn:
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            # If no game_id specified, get next upcoming game
+            if game_id is None:
+                execute_prepared(cursor, "next_game")
+                game = cursor.fetchone()
+                if not game:
+                    return {"error": "No upcoming games"}
+                game_id = game['id']
+            else:
+                cursor.execute("""
+                    SELECT id, start_time, location, max_players FROM games 
+                    WHERE id = %s
+                """, (game_id,))
+                game = cursor.fetchone()
+                if not game:
+                    return {"error": "Game not found"}
+            
+            # Get player's response status
             cursor.execute("""
-                SELECT id, start_time, location, max_players FROM games 
-                WHERE id = %s
-            """, (game_id,))
-            game = cursor.fetchone()
-            if not game:
-                return {"error": "Game not found"}
-        
-        # Get player's response status
-        cursor.execute("""
-            SELECT status, updated_at FROM game_responses
-            WHERE game_id = %s AND player_id = %s
-        """, (game_id, player['id']))
-        
-        response = cursor.fetchone()
-        
-        return {
-            "player_name": player['name'],
-            "player_id": player['id'],
-            "game_id": game['id'],
-            "game_time": game['start_time'],
-            "game_location": game['location'],
-            "max_players": game['max_players'],
-            "status": response['status'] if response else 'pending',
-            "updated_at": response['updated_at'] if response else None
-        }
-        
-    except Exception as e:
-        print(f"Error fetching player game status: {e}")
-        return None
-    finally:
-        conn.close()
+                SELECT status, updated_at FROM game_responses
+                WHERE game_id = %s AND player_id = %s
+            """, (game_id, player_id))
+            
+            response = cursor.fetchone()
+            
+            return {
+                "player_id": player_id,
+                "game_id": game['id'],
+                "game_time": game['start_time'],
+                "game_location": game['location'],
+                "max_players": game['max_players'],
+                "status": response['status'] if response else 'pending',
+                "updated_at": response['updated_at'] if response else None
+            }
+            
+        except Exception as e:
+            log.error("Error fetching player game status: %s", e)
+            return None
 
 def add_message_to_history(phone_number: str, role: str, content: str):
     """Adds a message to the conversation history."""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO conversation_history (phone_number, role, content)
-            VALUES (%s, %s, %s)
-        """, (phone_number, role, content))
-        conn.commit()
-    except Exception as e:
-        print(f"Error adding message to history: {e}")
-    finally:
-        conn.close()
+    with db_conn() as conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO conversation_history (phone_number, role, content)
+                VALUES (%s, %s, %s)
+            """, (phone_number, role, content))
+            conn.commit()
+        except Exception as e:
+            log.error("Error adding message to history: %s", e)
+
+def add_messages_to_history(phone_number: str, messages: list[tuple[str, str]]):
+    """
+    Adds several (role, content) messages to the conversation history in one INSERT.
+    Each row is stamped one microsecond after the previous one, so the batch
+    keeps its order even though it's inserted at once.
+    """
+    with db_conn() as conn:
+        try:
+            cursor = conn.cursor()
+            execute_values(
+                cursor,
+                "INSERT INTO conversation_history (phone_number, role, content, created_at) VALUES %s",
+                [(phone_number, role, content, position) for position, (role, content) in enumerate(messages)],
+                template="(%s, %s, %s, NOW() + %s * interval '1 microsecond')"
+            )
+            conn.commit()
+        except Exception as e:
+            log.error("Error adding messages to history: %s", e)
 
 def get_conversation_history(phone_number: str, limit: int = 10):
     """Retrieves the last N messages for a phone number."""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("""
-            SELECT role, content FROM conversation_history
-            WHERE phone_number = %s
-            ORDER BY created_at DESC
-            LIMIT %s
-        """, (phone_number, limit))
-        return cursor.fetchall()[::-1]
-    except Exception as e:
-        print(f"Error fetching history: {e}")
-        return []
-    finally:
-        conn.close()
-
+    with db_conn() as conn:
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            # Newest N via the (phone_number, created_at DESC) index, returned oldest first
+            cursor.execute("""
+                SELECT role, content FROM (
+                    SELECT role, content, created_at FROM conversation_history
+                    WHERE phone_number = %s
+                    ORDER BY created_at DESC
+                    LIMIT %s
+                ) recent
+                ORDER BY created_at ASC
+            """, (phone_number, limit))
+            return cursor.fetchall()
+        except Exception as e:
+            log.error("Error fetching history: %s", e)
+            return []
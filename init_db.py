@@ -1,7 +1,10 @@
-from database import get_db_connection
+from database import db_conn
 
 def init_db():
-    conn = get_db_connection()
+    with db_conn() as conn:
+        _create_tables(conn)
+
+def _create_tables(conn):
     cursor = conn.cursor()
 
     print("Creating tables...")
@@ -60,9 +63,16 @@ def init_db():
         );
     """)
 
+    # 5. Indexes for the hot lookups
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_games_start_time ON games(start_time);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gr_game_status ON game_responses(game_id, status);")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conv_phone_created
+        ON conversation_history(phone_number, created_at DESC);
+    """)
+
     conn.commit()
     cursor.close()
-    conn.close()
     print("Tables created successfully!")
 
 if __name__ == "__main__":
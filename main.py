@@ -1,32 +1,84 @@
 import os
 import json
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
 import httpx
 import uvicorn
 import argparse
 import asyncio
 from fastapi import FastAPI, Request, HTTPException, Query
 from dotenv import load_dotenv
-from agent_logic import agent_executor
+from agent_logic import (
+    agent_executor,
+    classify_trivial_reply,
+    record_rsvp,
+    route_and_respond,
+    trim_history
+)
 from database import (
     create_game, 
     get_active_players, 
     get_conversation_history, 
     add_message_to_history,
+    add_messages_to_history,
     get_player_by_phone,
-    get_player_game_status
+    get_player_game_status_by_id
 )
 from phone_utils import normalize_phone_number, format_for_whatsapp
-from prompts import INVITE_GENERATION_PROMPT_TEMPLATE, NEW_PLAYER_GREETING_TEMPLATE
+from prompts import NEW_PLAYER_GREETING_TEMPLATE, render_invite
 
 # Load environment variables
 load_dotenv()
 
+def setup_logging():
+    """
+    Sends log records through a queue to a background listener thread,
+    so request handlers never block on writing to stderr.
+    Does nothing if it has already run in this process.
+    """
+    root_logger = logging.getLogger()
+    if any(isinstance(handler, QueueHandler) for handler in root_logger.handlers):
+        return
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = QueueListener(log_queue, stream_handler)
+
+    root_logger.addHandler(QueueHandler(log_queue))
+    root_logger.setLevel(logging.INFO)
+
+    listener.start()
+    atexit.register(listener.stop)
+
+log = logging.getLogger(__name__)
+
 WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN")
 PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID")
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
 
+# Maximum number of invites generated/sent at the same time
+INVITE_CONCURRENCY = 10
+
 app = FastAPI()
 
+# Shared HTTP client so WhatsApp sends reuse pooled keep-alive connections
+_http = httpx.AsyncClient(
+    http2=True,
+    timeout=10.0,
+    limits=httpx.Limits(max_keepalive_connections=32)
+)
+
+@app.on_event("startup")
+async def start_logging():
+    setup_logging()
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await _http.aclose()
+
 async def send_whatsapp_message(to_number: str, text_body: str):
     """
     Sends a WhatsApp message using the Meta Graph API.
@@ -43,100 +95,153 @@ async def send_whatsapp_message(to_number: str, text_body: str):
         "text": {"body": text_body},
     }
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            print(f"Message sent to {to_number}: {response.json()}")
-        except httpx.HTTPStatusError as e:
-            print(f"Failed to send message: {e.response.text}")
-        except Exception as e:
-            print(f"Error sending message: {e}")
+    try:
+        response = await _http.post(url, headers=headers, json=data)
+        response.raise_for_status()
+        log.info("Message sent to %s: %s", to_number, response.json())
+    except httpx.HTTPStatusError as e:
+        log.error("Failed to send message: %s", e.response.text)
+    except Exception as e:
+        log.error("Error sending message: %s", e)
 
 def extract_text_content(content) -> str:
     """
     Extracts text content from LangChain agent response which might be structured.
     """
+    # Plain strings are by far the most common case
+    if isinstance(content, str):
+        return content
     if isinstance(content, list):
-        for block in content:
-            if isinstance(block, dict) and block.get("type") == "text":
-                return block.get("text")
+        text = next(
+            (block.get("text") for block in content if isinstance(block, dict) and block.get("type") == "text"),
+            None
+        )
         # Fallback if no text block found
-        return str(content)
+        return text if text is not None else str(content)
     elif isinstance(content, dict):
         if content.get("type") == "text":
             return content.get("text")
         return str(content)
     return str(content)
 
+async def invite_player(player, game_date: str):
+    """
+    Generates and sends a personalized invite to a single player.
+    """
+    phone = player['phone_number']
+    name = player['name']
+    country = player.get('country', 'Israel') # Default to Israel if not set
+    language = player.get('language', 'Hebrew') # Default to Hebrew if not set
+    
+    formatted_phone = format_for_whatsapp(phone)
+    
+    # Fetch history to provide context
+    history = await asyncio.to_thread(get_conversation_history, phone, limit=5)
+    formatted_history = [(msg['role'], msg['content']) for msg in history]
+    
+    # Construct the prompt for the agent using template
+    prompt = render_invite(
+        player_name=name,
+        game_date=game_date,
+        language=language
+    )
+    
+    # Add the prompt to the history for the agent's context
+    messages = formatted_history + [("user", prompt)]
+    
+    try:
+        # Invoke the agent to generate the invite
+        response = await agent_executor.ainvoke({"messages": messages})
+        invite_message = extract_text_content(response["messages"][-1].content)
+        
+        # Send the message
+        await send_whatsapp_message(formatted_phone, invite_message)
+        
+        # Save the invite to history so the conversation continues naturally
+        await asyncio.to_thread(add_message_to_history, phone, "ai", invite_message)
+        
+    except Exception as e:
+        log.error("Error generating/sending invite for %s: %s", name, e)
+        # Fallback to hardcoded message if agent fails
+        if language.lower() == 'hebrew':
+            fallback_msg = f"היי! מארגנים משחק כדורעף ב-{game_date}. את/ה בא/ה? תענה/י 'כן' או 'לא'."
+        else:
+            fallback_msg = f"Hey! We're setting up a volleyball game on {game_date}. Are you in? Reply with 'Yes' or 'No'."
+        await send_whatsapp_message(formatted_phone, fallback_msg)
+        await asyncio.to_thread(add_message_to_history, phone, "ai", fallback_msg)
+
 async def setup_new_game(game_date: str):
     """
     Creates a new game and invites all active players.
     """
-    print(f"Setting up a new game for {game_date}...")
+    log.info("Setting up a new game for %s...", game_date)
     
     # 1. Create the game in the DB
-    game = create_game(game_date)
+    game = await asyncio.to_thread(create_game, game_date)
     if not game:
-        print("Failed to create game. Aborting setup.")
+        log.error("Failed to create game. Aborting setup.")
         return
 
-    print(f"Game created with ID: {game['id']}")
+    log.info("Game created with ID: %s", game['id'])
 
     # 2. Get active players
-    players = get_active_players()
+    players = await asyncio.to_thread(get_active_players)
     if not players:
-        print("No active players found.")
+        log.info("No active players found.")
         return
 
-    print(f"Found {len(players)} active players. Sending invites...")
+    log.info("Found %s active players. Sending invites...", len(players))
 
-    # 3. Send invites
+    # 3. Send invites concurrently, capped so we don't flood the LLM/WhatsApp APIs
+    semaphore = asyncio.Semaphore(INVITE_CONCURRENCY)
 
-    for player in players:
-        phone = player['phone_number']
-        name = player['name']
-        country = player.get('country', 'Israel') # Default to Israel if not set
-        language = player.get('language', 'Hebrew') # Default to Hebrew if not set
-        
-        formatted_phone = format_for_whatsapp(phone)
-        
-        # Fetch history to provide context
-        history = get_conversation_history(phone, limit=5)
-        formatted_history = [(msg['role'], msg['content']) for msg in history]
-        
-        # Construct the prompt for the agent using template
-        prompt = INVITE_GENERATION_PROMPT_TEMPLATE.format(
-            player_name=name,
-            game_date=game_date,
-            language=language
+    async def invite_with_limit(player):
+        async with semaphore:
+            await invite_player(player, game_date)
+
+    await asyncio.gather(*(invite_with_limit(player) for player in players))
+
+    log.info("All invites sent!")
+
+async def generate_agent_reply(player, normalized_sender: str, message_body: str, game_status=None) -> str:
+    """
+    Builds the player's context and conversation history and generates a reply.
+    game_status can be passed in if the caller already fetched it.
+    """
+    player_name = player['name']
+
+    # 1. Get player's current game status and conversation history concurrently
+    log.info("Fetching status and history...")
+    if game_status is None:
+        game_status, history = await asyncio.gather(
+            asyncio.to_thread(get_player_game_status_by_id, player['id']),
+            asyncio.to_thread(get_conversation_history, normalized_sender, limit=6)
         )
+    else:
+        history = await asyncio.to_thread(get_conversation_history, normalized_sender, limit=6)
+    status_info = ""
+    if game_status and "error" not in game_status:
+        status_info = f"Current status for next game: {game_status['status']}"
+    else:
+        status_info = "No upcoming game or no response yet."
+
+    formatted_history = trim_history([(msg['role'], msg['content']) for msg in history])
         
-        # Add the prompt to the history for the agent's context
-        messages = formatted_history + [("user", prompt)]
-        
-        try:
-            # Invoke the agent to generate the invite
-            response = await agent_executor.ainvoke({"messages": messages})
-            invite_message = extract_text_content(response["messages"][-1].content)
-            
-            # Send the message
-            await send_whatsapp_message(formatted_phone, invite_message)
-            
-            # Save the invite to history so the conversation continues naturally
-            add_message_to_history(phone, "ai", invite_message)
-            
-        except Exception as e:
-            print(f"Error generating/sending invite for {name}: {e}")
-            # Fallback to hardcoded message if agent fails
-            if language.lower() == 'hebrew':
-                fallback_msg = f"היי! מארגנים משחק כדורעף ב-{game_date}. את/ה בא/ה? תענה/י 'כן' או 'לא'."
-            else:
-                fallback_msg = f"Hey! We're setting up a volleyball game on {game_date}. Are you in? Reply with 'Yes' or 'No'."
-            await send_whatsapp_message(formatted_phone, fallback_msg)
-            add_message_to_history(phone, "ai", fallback_msg)
-        
-    print("All invites sent!")
+    # 2. Add player context as a system message, then user message
+    # This gives the agent full context about who they're talking to
+    player_context = (
+        f"[CONTEXT] You are talking to {player_name} (phone: {normalized_sender}). "
+        f"{status_info}"
+    )
+    formatted_history.append(("system", player_context))
+    formatted_history.append(("user", message_body))
+
+    # 3. Route the message and generate the reply
+    log.info("Routing message...")
+    content = await route_and_respond(
+        formatted_history, normalized_sender, player.get('language', 'Hebrew')
+    )
+    return extract_text_content(content)
 
 @app.get("/webhook")
 async def verify_webhook(
@@ -149,12 +254,12 @@ async def verify_webhook(
     """
     try:
         if mode == "subscribe" and token == VERIFY_TOKEN:
-            print("Webhook verified successfully!")
+            log.info("Webhook verified successfully!")
             return int(challenge)
         else:
             raise HTTPException(status_code=403, detail="Verification failed")
     except Exception as e:
-        print(f"Error processing webhook: {e}")
+        log.error("Error processing webhook: %s", e)
         # Return 200 to prevent WhatsApp from retrying indefinitely in case of logic errors
         return {"status": "error", "message": str(e)}
 
@@ -164,31 +269,31 @@ async def webhook_handler(request: Request):
     Handles incoming WhatsApp messages.
     """
     try:
-        print("Webhook triggered!")
+        log.info("Webhook triggered!")
         payload = await request.json()
-        # print(f"Received payload: {json.dumps(payload, indent=2)}")
+        # log.debug("Received payload: %s", json.dumps(payload, indent=2))
 
         # Check if this is a message (not a status update)
         entry = payload.get("entry", [])
         if not entry:
-            print("No entry in payload")
+            log.info("No entry in payload")
             return {"status": "ignored", "reason": "no entry"}
 
         changes = entry[0].get("changes", [])
         if not changes:
-            print("No changes in payload")
+            log.info("No changes in payload")
             return {"status": "ignored", "reason": "no changes"}
 
         value = changes[0].get("value", {})
         
         # Ignore status updates (e.g., sent, delivered, read)
         if "statuses" in value:
-            # print("Ignoring status update")
+            # log.debug("Ignoring status update")
             return {"status": "ignored", "reason": "status update"}
 
         messages = value.get("messages", [])
         if not messages:
-            print("No messages in value")
+            log.info("No messages in value")
             return {"status": "ignored", "reason": "no messages"}
 
         # Process the first message
@@ -197,80 +302,66 @@ async def webhook_handler(request: Request):
         
         # We only handle text messages for now
         if message.get("type") != "text":
-            print(f"Ignoring non-text message type: {message.get('type')}")
+            log.info("Ignoring non-text message type: %s", message.get('type'))
             return {"status": "ignored", "reason": "not a text message"}
             
         message_body = message["text"]["body"]
-        print(f"Processing message from {sender_id}: {message_body}")
+        log.info("Processing message from %s: %s", sender_id, message_body)
         
         # Normalize the phone number for consistent database lookups
         normalized_sender = normalize_phone_number(sender_id)
 
         # 1. Lookup player info
-        print("Looking up player...")
-        player = get_player_by_phone(normalized_sender)
+        log.info("Looking up player...")
+        player = await asyncio.to_thread(get_player_by_phone, normalized_sender)
         
         if not player:
             # New player onboarding
-            print(f"Unknown player: {sender_id}")
+            log.info("Unknown player: %s", sender_id)
             await send_whatsapp_message(sender_id, NEW_PLAYER_GREETING_TEMPLATE)
-            add_message_to_history(normalized_sender, "user", message_body)
-            add_message_to_history(normalized_sender, "ai", NEW_PLAYER_GREETING_TEMPLATE)
+            await asyncio.to_thread(
+                add_messages_to_history,
+                normalized_sender,
+                [("user", message_body), ("ai", NEW_PLAYER_GREETING_TEMPLATE)]
+            )
             return {"status": "new_player_onboarding"}
         
         player_name = player['name']
         player_id = player['id']
-        print(f"Player identified: {player_name}")
+        log.info("Player identified: %s", player_name)
         
-        # 2. Get player's current game status
-        game_status = get_player_game_status(normalized_sender)
-        status_info = ""
-        if game_status and "error" not in game_status:
-            status_info = f"Current status for next game: {game_status['status']}"
+        # 2. Simple yes/no/maybe replies are logged directly without invoking the LLM,
+        # but only while the player hasn't answered the next game yet. Otherwise a bare
+        # "yes" may be answering something else, so the router decides.
+        trivial_status = classify_trivial_reply(message_body)
+        game_status = None
+        if trivial_status:
+            game_status = await asyncio.to_thread(get_player_game_status_by_id, player_id)
+        if trivial_status and game_status and game_status.get("status") == "pending":
+            log.info("Logging trivial reply as '%s'", trivial_status)
+            ai_message = await record_rsvp(
+                normalized_sender, trivial_status, player.get('language', 'Hebrew')
+            )
         else:
-            status_info = "No upcoming game or no response yet."
-
-        # 3. Fetch conversation history
-        print("Fetching history...")
-        history = get_conversation_history(normalized_sender, limit=10)
-        formatted_history = []
-        for msg in history:
-            formatted_history.append((msg['role'], msg['content']))
-            
-        # 4. Add player context as a system message, then user message
-        # This gives the agent full context about who they're talking to
-        player_context = (
-            f"[CONTEXT] You are talking to {player_name} (phone: {normalized_sender}). "
-            f"{status_info}"
-        )
-        formatted_history.append(("system", player_context))
-        formatted_history.append(("user", message_body))
-
-        # 5. Invoke the agent with full context
-        print("Invoking agent...")
-        # Pass the phone number in config so tools can access it
-        config = {"configurable": {"player_phone": normalized_sender}}
-        response = agent_executor.invoke({"messages": formatted_history}, config=config)
-        
-        # Get the last message from the agent (the AI response)
-        ai_message = extract_text_content(response["messages"][-1].content)
-        print(f"AI Response: {ai_message}")
+            ai_message = await generate_agent_reply(player, normalized_sender, message_body, game_status)
+        log.info("AI Response: %s", ai_message)
 
-        # 6. Save messages to DB
-        print("Saving to DB...")
-        add_message_to_history(normalized_sender, "user", message_body)
-        add_message_to_history(normalized_sender, "ai", ai_message)
+        # 3. Save messages to DB
+        log.info("Saving to DB...")
+        await asyncio.to_thread(
+            add_messages_to_history,
+            normalized_sender,
+            [("user", message_body), ("ai", ai_message)]
+        )
 
-        # 7. Send the response back to WhatsApp
-        print("Sending response to WhatsApp...")
+        # 4. Send the response back to WhatsApp
+        log.info("Sending response to WhatsApp...")
         await send_whatsapp_message(sender_id, ai_message)
 
         return {"status": "processed"}
 
     except Exception as e:
-        print(f"Error processing webhook: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error processing webhook: %s", e)
         return {"status": "error", "message": str(e)}
 
 if __name__ == "__main__":
@@ -279,6 +370,7 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     if args.new_game:
+        setup_logging()
         asyncio.run(setup_new_game(args.new_game))
     
     # Always run the server to listen for replies
@@ -1,13 +1,39 @@
-from pydantic import BaseModel, Field, EmailStr
-from typing import Optional
+from pydantic import BaseModel, BeforeValidator, ConfigDict, PlainSerializer, TypeAdapter, WithJsonSchema
+from typing import Annotated, Literal, Optional
 from datetime import datetime
 from uuid import UUID
 
+# Fixed vocabularies, validated by pydantic-core rather than accepting any string
+SkillLevel = Literal["Beginner", "Intermediate", "Advanced"]
+GameStatus = Literal["recruiting", "full", "cancelled", "completed"]
+ResponseStatus = Literal["pending", "confirmed", "declined", "maybe"]
+
+def _to_uuid_bytes(value) -> bytes:
+    """Accepts a UUID, its 16 raw bytes, or its string form."""
+    if isinstance(value, UUID):
+        return value.bytes
+    if isinstance(value, bytes):
+        return UUID(bytes=value).bytes  # raises if not 16 bytes
+    return UUID(str(value)).bytes
+
+# UUIDs are held as 16 raw bytes (smaller than uuid.UUID objects, cheaper to compare)
+# and serialized back to the canonical string form
+UuidBytes = Annotated[
+    bytes,
+    BeforeValidator(_to_uuid_bytes),
+    PlainSerializer(lambda b: str(UUID(bytes=b)), return_type=str),
+    WithJsonSchema({"type": "string", "format": "uuid"}),
+]
+
+# Shared config for models read back from the database
+class _ORMBase(BaseModel):
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
 # 1. PLAYERS
 class PlayerBase(BaseModel):
     name: str
     phone_number: str
-    skill_level: str = "Intermediate"
+    skill_level: SkillLevel = "Intermediate"
     active: bool = True
     language: str = "English"
     country: str = "Israel"
@@ -15,44 +41,41 @@ class PlayerBase(BaseModel):
 class PlayerCreate(PlayerBase):
     pass
 
-class Player(PlayerBase):
-    id: UUID
+class Player(_ORMBase, PlayerBase):
+    id: UuidBytes
     created_at: datetime
 
-    class Config:
-        from_attributes = True
-
 # 2. GAMES
 class GameBase(BaseModel):
     start_time: datetime
     location: str = "Beach Court 1"
-    status: str = "recruiting"
+    status: GameStatus = "recruiting"
     max_players: int = 4
 
 class GameCreate(GameBase):
     pass
 
-class Game(GameBase):
-    id: UUID
+class Game(_ORMBase, GameBase):
+    id: UuidBytes
     created_at: datetime
 
-    class Config:
-        from_attributes = True
-
 # 3. RESPONSES
 class GameResponseBase(BaseModel):
-    game_id: UUID
-    player_id: UUID
-    status: str = "pending"
+    game_id: UuidBytes
+    player_id: UuidBytes
+    status: ResponseStatus = "pending"
     original_message: Optional[str] = None
     ai_confidence: Optional[float] = None
 
 class GameResponseCreate(GameResponseBase):
     pass
 
-class GameResponse(GameResponseBase):
-    id: UUID
+class GameResponse(_ORMBase, GameResponseBase):
+    id: UuidBytes
     updated_at: datetime
 
-    class Config:
-        from_attributes = True
+# 4. LIST ADAPTERS
+# Validate whole lists of DB rows in one call instead of a model_validate() per row
+PlayerListAdapter = TypeAdapter(list[Player])
+GameListAdapter = TypeAdapter(list[Game])
+GameResponseListAdapter = TypeAdapter(list[GameResponse])
@@ -4,8 +4,15 @@ across different contexts (WhatsApp API, database storage, display).
 """
 
 import re
+from functools import lru_cache
 
+# Matches every non-digit character (the complement of str.isdecimal)
+_NON_DIGIT_RE = re.compile(r'\D')
+# Splits a string into chunks of up to 3 characters
+_CHUNK3_RE = re.compile(r'.{1,3}')
 
+
+@lru_cache(maxsize=4096)
 def normalize_phone_number(phone: str, country: str = "Israel") -> str:
     """
     Normalizes a phone number to international format without the '+' prefix.
@@ -25,41 +32,40 @@ def normalize_phone_number(phone: str, country: str = "Israel") -> str:
         >>> normalize_phone_number("+972 50 123 4567", "Israel")
         "972501234567"
     """
-    # Remove all non-digit characters
-    clean_phone = re.sub(r'\D', '', phone)
+    # Fast path: already normalized Israeli numbers (the usual WhatsApp sender ID)
+    # come out unchanged for every country
+    if len(phone) == 12 and phone[:3] == "972" and phone.isdecimal():
+        return phone
+
+    # Remove all non-digit characters (skipping the regex if there are none)
+    clean_phone = phone if phone.isdecimal() else _NON_DIGIT_RE.sub('', phone)
     
-    if country.lower() == "israel":
+    # The default spelling is checked first to skip the lower() allocation
+    if country == "Israel" or country.lower() == "israel":
+        # Prefixes are compared by slicing, which is cheaper than startswith() calls
+        first_digit = clean_phone[:1]
         # If starts with 0, replace with 972
-        if clean_phone.startswith("0"):
+        if first_digit == "0":
             return "972" + clean_phone[1:]
         # If already starts with 972, return as is
-        if clean_phone.startswith("972"):
+        if clean_phone[:3] == "972":
             return clean_phone
-        # If it's just digits without country code, assume Israel
-        if len(clean_phone) == 9 or len(clean_phone) == 10:
-            if clean_phone.startswith("5"):  # Mobile number
-                return "972" + clean_phone
+        # If it's a mobile number (5X) without country code, assume Israel
+        if first_digit == "5" and len(clean_phone) in (9, 10):
+            return "972" + clean_phone
     
     # Default: return cleaned number as-is
     return clean_phone
 
 
-def format_for_whatsapp(phone: str) -> str:
-    """
-    Formats a phone number for WhatsApp API (international format without '+').
-    
-    Args:
-        phone: Phone number in any format
-        
-    Returns:
-        Phone number ready for WhatsApp API
-        
-    Example:
-        >>> format_for_whatsapp("050-123-4567")
-        "972501234567"
-    """
-    # WhatsApp uses the same format as our normalized format
-    return normalize_phone_number(phone)
+# Formats a phone number for WhatsApp API (international format without '+').
+# WhatsApp uses the same format as our normalized format, so this is an alias
+# rather than a wrapper (saves a call frame and shares the normalization cache).
+#
+# Example:
+#     >>> format_for_whatsapp("050-123-4567")
+#     "972501234567"
+format_for_whatsapp = normalize_phone_number
 
 
 def format_for_display(phone: str, country: str = "Israel") -> str:
@@ -77,11 +83,16 @@ def format_for_display(phone: str, country: str = "Israel") -> str:
         >>> format_for_display("972501234567", "Israel")
         "050-123-4567"
     """
-    clean_phone = re.sub(r'\D', '', phone)
+    clean_phone = phone if phone.isdecimal() else _NON_DIGIT_RE.sub('', phone)
     
-    if country.lower() == "israel":
-        # Remove 972 prefix if present
-        if clean_phone.startswith("972"):
+    if country == "Israel" or country.lower() == "israel":
+        # Remove 972 prefix if present. The common lengths are formatted
+        # straight from the international form, without building the local one first.
+        if clean_phone[:3] == "972":
+            if len(clean_phone) == 12:
+                return f"0{clean_phone[3:5]}-{clean_phone[5:8]}-{clean_phone[8:]}"
+            if len(clean_phone) == 11:
+                return f"0{clean_phone[3]}-{clean_phone[4:7]}-{clean_phone[7:]}"
             clean_phone = "0" + clean_phone[3:]
         
         # Format as XXX-XXX-XXXX
@@ -91,7 +102,7 @@ def format_for_display(phone: str, country: str = "Israel") -> str:
             return f"{clean_phone[0:2]}-{clean_phone[2:5]}-{clean_phone[5:]}"
     
     # Default: return with dashes every 3 digits
-    return "-".join([clean_phone[i:i+3] for i in range(0, len(clean_phone), 3)])
+    return "-".join(_CHUNK3_RE.findall(clean_phone))
 
 
 def are_phones_equivalent(phone1: str, phone2: str, country: str = "Israel") -> bool:
@@ -110,4 +121,10 @@ def are_phones_equivalent(phone1: str, phone2: str, country: str = "Israel") ->
         >>> are_phones_equivalent("050-123-4567", "972501234567")
         True
     """
-    return normalize_phone_number(phone1, country) == normalize_phone_number(phone2, country)
+    digits1 = phone1 if phone1.isdecimal() else _NON_DIGIT_RE.sub('', phone1)
+    digits2 = phone2 if phone2.isdecimal() else _NON_DIGIT_RE.sub('', phone2)
+    # Same digits always normalize the same way
+    if digits1 == digits2:
+        return True
+    # Only the prefix rules can still make them equal
+    return normalize_phone_number(digits1, country) == normalize_phone_number(digits2, country)
@@ -3,6 +3,9 @@ Centralized prompt templates for the Volly chatbot.
 This makes it easier to maintain, test, and version prompts.
 """
 
+import re
+from types import MappingProxyType
+
 # Main agent system prompt
 AGENT_SYSTEM_PROMPT = """You are Volly, a friendly and energetic volleyball game organizer. 
 Your goal is to help players join games, answer their questions about upcoming games, and maintain a natural conversation.
@@ -35,6 +38,42 @@ You have access to tools to check game availability, get game details, and log p
 - If someone asks about their status, check and let them know
 """
 
+# Router prompt: classifies an incoming message so the matching tool can run directly
+ROUTER_SYSTEM_PROMPT = """You route WhatsApp messages sent to Volly, a volleyball game organizer.
+Classify the player's latest message using the conversation for context.
+
+- intent='log' when the player confirms, declines, or is unsure about attending a game.
+  Set status to 'confirmed', 'declined', or 'maybe'.
+- intent='get_details' when the player asks when or where a game is.
+- intent='availability' when the player asks who's coming.
+- intent='chat' for anything else.
+
+Set date_query to the game date the player refers to (YYYY-MM-DD), or 'next' for the upcoming game.
+A short reply like "yes" or "can't" right after an invite is an RSVP.
+"""
+
+# Reply prompt for route_and_respond: the model has no tools here, and any
+# tool results were already added to the conversation as [GAME DETAILS] / [AVAILABILITY]
+REPLY_SYSTEM_PROMPT = """You are Volly, a friendly and energetic volleyball game organizer chatting with a player on WhatsApp.
+
+## Important Context:
+- You will receive a [CONTEXT] message with the player's name and their current status for the next game.
+- Game details or the list of who's coming may be included as [GAME DETAILS] or [AVAILABILITY] messages. Only use facts from those messages.
+
+## Attendance:
+- You cannot record attendance in this reply. Never say you've signed the player up, marked them as out, or noted their answer.
+- If the player seems to be answering whether they're coming but it isn't clear, ask them to confirm if they're in, out, or a maybe.
+
+## Conversation style:
+- Be concise - you're chatting on WhatsApp, not writing essays
+- Use casual language, in the player's language
+- When mentioning dates, use words like "next Tuesday" instead of "2025-12-05"
+- Mention time as "morning/afternoon/evening" initially, provide exact time only when asked
+- DON'T use emojis
+- Respond to casual conversation naturally
+- Keep responses short and natural
+"""
+
 # Template for generating game invites
 INVITE_GENERATION_PROMPT_TEMPLATE = """Generate a short, friendly WhatsApp invite for a volleyball game.
 
@@ -62,10 +101,90 @@ NEW_PLAYER_GREETING_TEMPLATE = """Hey! I don't think we've met. What's your name
 # Template for asking about player availability when context is missing
 ASK_AVAILABILITY_TEMPLATE = """Hey {player_name}, are you coming to the game on {game_date}?"""
 
-# Error messages (user-friendly versions)
-ERROR_MESSAGES = {
+def _compile_template(template: str) -> tuple:
+    """Splits a {field} template once into alternating literal and field-name segments."""
+    return tuple(re.split(r'\{(\w+)\}', template))
+
+def _render(segments: tuple, values: dict) -> str:
+    """Fills a compiled template without re-parsing it."""
+    parts = list(segments)
+    for i in range(1, len(parts), 2):
+        parts[i] = str(values[parts[i]])
+    return "".join(parts)
+
+_INVITE_SEGMENTS = _compile_template(INVITE_GENERATION_PROMPT_TEMPLATE)
+# The supported languages have {language} folded in ahead of time
+_INVITE_SEGMENTS_BY_LANG = {
+    lang: _compile_template(INVITE_GENERATION_PROMPT_TEMPLATE.replace("{language}", lang))
+    for lang in ("English", "Hebrew")
+}
+_ASK_AVAILABILITY_SEGMENTS = _compile_template(ASK_AVAILABILITY_TEMPLATE)
+
+def render_invite(player_name: str, game_date: str, language: str) -> str:
+    """Equivalent to INVITE_GENERATION_PROMPT_TEMPLATE.format(...)."""
+    segments = _INVITE_SEGMENTS_BY_LANG.get(language, _INVITE_SEGMENTS)
+    return _render(segments, {
+        "player_name": player_name,
+        "game_date": game_date,
+        "language": language,
+    })
+
+def render_ask_availability(player_name: str, game_date: str) -> str:
+    """Equivalent to ASK_AVAILABILITY_TEMPLATE.format(...)."""
+    return _render(_ASK_AVAILABILITY_SEGMENTS, {
+        "player_name": player_name,
+        "game_date": game_date,
+    })
+
+# Error messages (user-friendly versions), read-only
+ERROR_MESSAGES = MappingProxyType({
     "no_upcoming_game": "No games scheduled yet, I'll let you know when something's up!",
     "database_error": "Hmm, had a little technical issue. Can you try again?",
     "player_not_found": "I don't have you in my list yet. What's your name?",
     "generic_error": "Oops, something went wrong. Mind trying again?"
-}
+})
+
+# Confirmations sent straight to the player when an RSVP is recorded without
+# the agent phrasing it, keyed by language then status. {when} is the game's
+# day and part of day, e.g. "Tuesday evening".
+RSVP_CONFIRMATIONS = MappingProxyType({
+    "English": MappingProxyType({
+        "confirmed": "Got it, you're in for {when}!",
+        "declined": "No worries, marked you as out for {when}.",
+        "maybe": "Cool, you're a maybe for {when} for now.",
+        "pending": "Updated, your spot for {when} is pending again.",
+    }),
+    "Hebrew": MappingProxyType({
+        "confirmed": "מעולה, רשמתי אותך ל{when}!",
+        "declined": "אין בעיה, רשמתי שלא תגיע/י ל{when}.",
+        "maybe": "סבבה, רשמתי אותך כאולי ל{when}.",
+        "pending": "עדכנתי, הסטטוס שלך ל{when} חזר להמתנה.",
+    }),
+})
+
+_WEEKDAYS = MappingProxyType({
+    "English": ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"),
+    "Hebrew": ("יום שני", "יום שלישי", "יום רביעי", "יום חמישי", "יום שישי", "שבת", "יום ראשון"),
+})
+
+# (morning, afternoon, evening)
+_PARTS_OF_DAY = MappingProxyType({
+    "English": ("morning", "afternoon", "evening"),
+    "Hebrew": ("בבוקר", "אחר הצהריים", "בערב"),
+})
+
+def render_rsvp_confirmation(status: str, game_time, language: str) -> str:
+    """
+    Formats the confirmation for a recorded RSVP. game_time is a datetime in the
+    game's local time; languages without translations get the English text.
+    """
+    if language not in RSVP_CONFIRMATIONS:
+        language = "English"
+    if game_time.hour < 12:
+        part_of_day = _PARTS_OF_DAY[language][0]
+    elif game_time.hour < 17:
+        part_of_day = _PARTS_OF_DAY[language][1]
+    else:
+        part_of_day = _PARTS_OF_DAY[language][2]
+    when = f"{_WEEKDAYS[language][game_time.weekday()]} {part_of_day}"
+    return RSVP_CONFIRMATIONS[language][status].format(when=when)